@@ -2,58 +2,245 @@
 from __future__ import annotations
 
 import logging
+import contextlib
 import sys
 import os
-import argparse
-import subprocess
+import stat
 
-from typing import Generator, Dict
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Generator, Dict, Iterator, List, Tuple
 
 from shexec.shexec import CDMSModuleLoader, ResultExecStatus, ResultExec
 
+if TYPE_CHECKING:
+    from shexec.cache import ResultCache
+
 log = logging.getLogger('shellexecutor' if __name__ == '__main__' else __name__)
 
-def search_py_files(rootdir: str) -> Generator[Dict[str, str], None, None]:
+def _file_or_dir(entry: os.DirEntry) -> Tuple[bool, bool]:
+    """Check if the directory entry is a file or a directory, following symlinks
+
+    Args:
+        entry (os.DirEntry): directory entry
+
+    Returns:
+        Tuple[bool, bool]: is file and is directory flags, both False if the
+        entry can not be stat()ed, as os.path.isfile/isdir do
+    """
+    try:
+        return entry.is_file(), entry.is_dir()
+    except OSError:
+        # e.g. symlink loop or target not accessible
+        return False, False
+
+def _scan_dir(dirpath: str) -> List[Tuple[str, bool, bool]]:
+    """List the given directory sorted by entry name
+
+    Args:
+        dirpath (str): directory to list
+
+    Returns:
+        List[Tuple[str, bool, bool]]: sorted (name, is_file, is_dir) tuples,
+        empty if the directory does not exist or is not readable
+
+    Raises:
+        OSError: raise on any other error listing the directory
+    """
+    try:
+        # scandir reuses the cached d_type of each entry, so plain files
+        # and directories are classified without an extra stat() call.
+        # Symlinks still need one, it is done here to run in the worker thread
+        with os.scandir(dirpath) as it:
+            return sorted((entry.name, *_file_or_dir(entry))
+                          for entry in it)
+
+    except FileNotFoundError:
+        log.debug("Warn: File not found for [%s]. Skipped", dirpath)
+    except PermissionError:
+        log.debug("Warn: Permission denied for [%s]. Skipped", dirpath)
+    return []
+
+def search_py_files(rootdir: str,
+                    max_workers: int = 8,
+                    max_read_ahead: int = 16) -> Generator[Dict[str, str], None, None]:
     """Search for python files in the given root directory
 
+    Directories are listed concurrently in a thread pool, but files are
+    yielded in the same order as a sequential depth-first walk.
+
     Args:
         rootdir (str): starting directory to search for python files
+        max_workers (int, optional): threads listing directories. Defaults to 8.
+        max_read_ahead (int, optional): directory listings read ahead of the
+            walk at most. Defaults to 16.
 
     Yields:
         Generator[Dict[str, str], None, None]: dictionary containing the
         directory path and filename
     """
+    # a single stat() serves both the file and the directory checks
     try:
-        # symlink also will be considered as file
-        if os.path.isfile(rootdir) and rootdir.endswith('.py'):
-            yield {'dirpath': os.path.dirname(rootdir),
-                    'filename': os.path.basename(rootdir)}
-
-        # symlink also will be considered as directory
-        elif os.path.isdir(rootdir):
-            for entry in sorted(os.listdir(rootdir)):
-                full_path = os.path.join(rootdir, entry)
-                if os.path.isfile(full_path) and full_path.endswith('.py'):
-                    yield {'dirpath': rootdir,
-                           'filename': entry}
-
-                elif os.path.isdir(full_path):
-                    yield from search_py_files(full_path)
-
-                else:
-                    log.debug("Warn: [%s] is not a valid file or directory. Skipped", full_path)
-        else:
-            log.debug("Warn: [%s] is not a valid file or directory. Skipped", rootdir)
-
+        # symlink also will be followed
+        st_mode = os.stat(rootdir).st_mode
     except FileNotFoundError:
         log.debug("Warn: File not found for [%s]. Skipped", rootdir)
+        return
     except PermissionError:
         log.debug("Warn: Permission denied for [%s]. Skipped", rootdir)
+        return
     except OSError as e:
         log.error("Error: [%s]", e)
         sys.exit(1)
 
+    if stat.S_ISREG(st_mode) and rootdir.endswith('.py'):
+        yield {'dirpath': os.path.dirname(rootdir),
+                'filename': os.path.basename(rootdir)}
+
+    elif stat.S_ISDIR(st_mode):
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        # listings read ahead and not consumed yet, by directory path
+        read_ahead: Dict[str, Future] = {}
+
+        def entries(dirpath: str) -> Iterator[Tuple[str, bool, bool]]:
+            future = read_ahead.pop(dirpath, None)
+            if future is None:
+                future = pool.submit(_scan_dir, dirpath)
+            try:
+                dir_entries = future.result()
+            except OSError as e:
+                log.error("Error: [%s]", e)
+                sys.exit(1)
+
+            # list the first subdirectories in background, they are visited
+            # next. Bounded, so a wide tree is not held in memory at once
+            for name, _, is_dir in dir_entries:
+                if len(read_ahead) >= max_read_ahead:
+                    break
+                if is_dir:
+                    subdir = os.path.join(dirpath, name)
+                    if subdir not in read_ahead:
+                        read_ahead[subdir] = pool.submit(_scan_dir, subdir)
+            return iter(dir_entries)
+
+        try:
+            # walk with an explicit stack of (dirpath, entries iterator) instead of
+            # recursion, descending into a subdirectory as soon as it is met to
+            # keep the same order as a recursive walk
+            stack = deque([(rootdir, entries(rootdir))])
+            while stack:
+                dirpath, dir_entries = stack[-1]
+                for name, is_file, is_dir in dir_entries:
+                    # match the name itself, the full path is only joined
+                    # for subdirectories
+                    if is_file and name[-3:] == '.py':
+                        yield {'dirpath': dirpath,
+                               'filename': name}
+
+                    elif is_dir:
+                        subdir = os.path.join(dirpath, name)
+                        stack.append((subdir, entries(subdir)))
+                        break
+
+                    else:
+                        log.debug("Warn: [%s%s%s] is not a valid file or directory. Skipped",
+                                  dirpath, os.sep, name)
+                else:
+                    stack.pop()
+        finally:
+            pool.shutdown(cancel_futures=True)
+    else:
+        log.debug("Warn: [%s] is not a valid file or directory. Skipped", rootdir)
+
+def execute_cmd(cmd: str, module: CDMSModuleLoader, n_cmd: int,
+                dry_run: bool = False,
+                cache: ResultCache | None = None) -> ResultExec:
+    """Execute a shell command loaded from the given module
+
+    Args:
+        cmd (str): shell command
+        module (CDMSModuleLoader): module the command was loaded from
+        n_cmd (int): index of the command in module CMDS
+        dry_run (bool, optional): do not execute the command. Defaults to False.
+        cache (ResultCache | None, optional): reuse and store results of
+            previous runs. Defaults to None.
+
+    Returns:
+        ResultExec: result of the execution
+    """
+    log.debug('Executing [%s] from [%s]', cmd, module.module_name)
+
+    if dry_run:
+        return ResultExec(
+            module=module, n_cmd=n_cmd,
+            status=ResultExecStatus.DRY_RUN)
+
+    cached = cache.get(cmd) if cache is not None else None
+    if cached is not None:
+        log.debug('Found cached result for [%s]', cmd)
+        # only successful results are stored
+        _, stdout, stderr = cached
+        return ResultExec(
+            module=module, n_cmd=n_cmd,
+            status=ResultExecStatus.SUCCESS,
+            stdout=stdout,
+            stderr=stderr,
+            cached=True)
+
+    # imported here, only needed to spawn a command: dry-run and cache hits
+    # return before. Without --cache nothing else imports tempfile
+    import subprocess
+    import tempfile
+
+    # stdout is only used for logging and caching, drop it otherwise
+    keep_stdout = cache is not None or log.isEnabledFor(logging.INFO)
+
+    try:
+        # output goes to temporary files instead of pipes: no pipe-full
+        # backpressure and no poll loop in the parent for chatty commands.
+        # Kept output is still read back whole, it does not lower peak memory
+        with (tempfile.TemporaryFile() if keep_stdout else contextlib.nullcontext()) as f_out, \
+                tempfile.TemporaryFile() as f_err:
+            # close_fds stays True: fds inherited from our caller must not leak
+            # to commands (a leaked pipe end can hang a reader of our output).
+            # It rules out posix_spawn(), CPython still uses vfork() on Linux
+            result_run = subprocess.run(
+                cmd, shell=True, check=False,
+                stdout=f_out if f_out is not None else subprocess.DEVNULL,
+                stderr=f_err)
+
+            stdout = b''
+            if f_out is not None:
+                f_out.seek(0)
+                stdout = f_out.read()
+            f_err.seek(0)
+            stderr = f_err.read()
+
+    except (FileNotFoundError, OSError) as os_err:
+        return ResultExec(
+            module=module, n_cmd=n_cmd,
+            status=ResultExecStatus.FAILED,
+            stderr=str(os_err).encode('utf-8'))
+
+    # only successful results are cached, failed commands are retried next run.
+    # The command did run, failing to cache its result does not fail it
+    if cache is not None and result_run.returncode == 0:
+        try:
+            cache.set(cmd, result_run.returncode, stdout, stderr)
+        except OSError as os_err:
+            log.warning('Failed to cache result of cmd [%s]: %s', cmd, os_err)
+
+    return ResultExec(
+        module=module, n_cmd=n_cmd,
+        status=ResultExecStatus.SUCCESS     \
+            if result_run.returncode == 0   \
+            else ResultExecStatus.FAILED,
+        stdout=stdout,
+        stderr=stderr)
+
 def main():
+    import argparse
+
     parser = argparse.ArgumentParser(
         "Shell Executor", description="Execute shell commands from py files")
     parser.add_argument('rootdir', help='Root directory to search for py files')
@@ -61,7 +248,18 @@ def main():
                         action='store_true', help='Enable debug mode')
     parser.add_argument('-t', '--dry-run',
                         action='store_true', help='Enable dry-run mode')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of commands executed in parallel')
+    parser.add_argument('-c', '--cache',
+                        action='store_true',
+                        help='Reuse results of commands succeeded in previous runs')
+    parser.add_argument('-p', '--precompile',
+                        action='store_true',
+                        help='Compile all py files to __pycache__ first, only speeds up '
+                             'loading of files executed to get CMDS')
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('argument -j/--jobs: must be at least 1')
 
     logging.basicConfig(
         level=logging.DEBUG if args.debug else logging.INFO,
@@ -70,7 +268,19 @@ def main():
     if args.dry_run:
         log.info('== Dry-run mode enabled. Commands will NOT be executed ==')
 
-    results_exec = {}
+    if args.precompile:
+        import compileall
+
+        # compile in parallel up-front, modules executed to get CMDS
+        # then only read the cached bytecode. Syntax errors are reported
+        # when loading
+        if os.path.isdir(args.rootdir):
+            compileall.compile_dir(args.rootdir, quiet=2, workers=0)
+        else:
+            compileall.compile_file(args.rootdir, quiet=2)
+
+    # load all modules first, their commands are executed in this order
+    modules = []
     for pyfile in search_py_files(args.rootdir):
         log.debug('>> Found [%s] in [%s]',
                   pyfile['filename'], pyfile['dirpath'])
@@ -82,56 +292,66 @@ def main():
                         pyfile['filename'], pyfile['dirpath'], err)
             continue
 
-        for n_cmd, cmd in enumerate(executor.cmds):
-            log.debug('Executing [%s] from [%s]', cmd, pyfile['filename'])
-
-            res_exec = None
-            # skip if command already executed earlier
-            if cmd in results_exec:
-                res_exec = ResultExec(
-                    module=executor,
-                    n_cmd=n_cmd,
-                    status=ResultExecStatus.SKIPPED)
-                log.info('Skipped cmd [%s] from [%s] number [%s]. Command already executed.',
-                         cmd, res_exec.module.module_path, n_cmd)
-                results_exec[cmd].append(res_exec)
-                continue
-
-            if not args.dry_run:
-                try:
-                    result_run = subprocess.run(
-                        cmd, shell=True, check=False,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE)
-
-                    res_exec = ResultExec(
-                        module=executor, n_cmd=n_cmd,
-                        status=ResultExecStatus.SUCCESS     \
-                            if result_run.returncode == 0   \
-                            else ResultExecStatus.FAILED,
-                        stdout=result_run.stdout.decode('utf-8'),
-                        stderr=result_run.stderr.decode('utf-8'))
-
-                except (FileNotFoundError, OSError) as f_err:
-                    res_exec = ResultExec(
-                        module=executor, n_cmd=n_cmd,
-                        status=ResultExecStatus.FAILED,
-                        stderr=str(f_err))
-
-            else:
-                res_exec = ResultExec(
-                    module=executor, n_cmd=n_cmd,
-                    status=ResultExecStatus.DRY_RUN)
-
-            # pylint: disable=logging-not-lazy
-            results_exec[cmd] = [res_exec]
-            log.info('Executed cmd [%s] from [%s] number [%s] status [%s]' +
-                     f"{'\n\tstdout [%s] stderr [%s]' if not args.dry_run else '%s%s'}",
-                     cmd, res_exec.module.module_path, n_cmd,
-                     res_exec.status.value,
-                     res_exec.stdout.strip() if not args.dry_run else '',
-                     res_exec.stderr.strip() if not args.dry_run else '')
-            # pylint: enable=logging-not-lazy
+        modules.append(executor)
+
+    # each command is executed only once, by the first module using it.
+    # Duplicates within a module are already dropped by the loader
+    unique_cmds = {}
+    for executor in modules:
+        for n_cmd, cmd in executor.unique_cmds:
+            unique_cmds.setdefault(cmd, (executor, n_cmd))
+
+    cache = None
+    if args.cache and not args.dry_run:
+        # imported here, loads hashlib and tempfile
+        from shexec.cache import ResultCache
+
+        try:
+            cache = ResultCache()
+        except OSError as os_err:
+            log.warning('Failed to create cache. Results will not be cached: %s', os_err)
+
+    fmt_executed = 'Executed cmd [%s] from [%s] number [%s] status [%s]'
+    fmt_cached = 'Reused cached result of cmd [%s] from [%s] number [%s] status [%s]'
+    if not args.dry_run:
+        fmt_executed += '\n\tstdout [%s] stderr [%s]'
+        fmt_cached += '\n\tstdout [%s] stderr [%s]'
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        # results are yielded in the order of unique_cmds
+        results_run = pool.map(
+            lambda item: execute_cmd(item[0], *item[1],
+                                     dry_run=args.dry_run, cache=cache),
+            unique_cmds.items())
+
+        for executor in modules:
+            duplicates = executor.duplicates
+            for n_cmd, cmd in enumerate(executor.cmds):
+                # duplicates within the module, deduped at load time
+                if n_cmd in duplicates:
+                    log.info('Skipped cmd [%s] from [%s] number [%s]. Command already executed.',
+                             cmd, executor.module_path, n_cmd)
+                    continue
+
+                # skip if command already executed earlier, by another module
+                if unique_cmds[cmd] != (executor, n_cmd):
+                    log.info('Skipped cmd [%s] from [%s] number [%s]. Command already executed.',
+                             cmd, executor.module_path, n_cmd)
+                    continue
+
+                res_exec = next(results_run)
+                # output is kept as bytes, decode it only if it will be logged
+                if log.isEnabledFor(logging.INFO):
+                    if args.dry_run:
+                        log.info(fmt_executed,
+                                 cmd, res_exec.module.module_path, n_cmd,
+                                 res_exec.status.value)
+                    else:
+                        log.info(fmt_cached if res_exec.cached else fmt_executed,
+                                 cmd, res_exec.module.module_path, n_cmd,
+                                 res_exec.status.value,
+                                 res_exec.stdout.decode('utf-8', 'replace').strip(),
+                                 res_exec.stderr.decode('utf-8', 'replace').strip())
 
 
 if __name__ == '__main__':
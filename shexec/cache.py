@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import logging
+import os
+import hashlib
+import marshal
+import tempfile
+
+log = logging.getLogger( __name__)
+
+class ResultCache():
+    def __init__(self, path: str = '.shexe-cache') -> None:
+        """On-disk cache of command results, one file per command.
+
+        Args:
+            path (str, optional): cache directory. Defaults to '.shexe-cache'.
+        """
+        self.__path = path
+        os.makedirs(self.__path, exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        """Getter for cache directory.
+
+        Returns:
+            str: cache directory
+        """
+        return self.__path
+
+    def __key_path(self, cmd: str) -> str:
+        return os.path.join(self.__path,
+                            hashlib.sha256(cmd.encode('utf-8')).hexdigest())
+
+    def get(self, cmd: str) -> tuple[int, bytes, bytes] | None:
+        """Get cached result of the command.
+
+        Args:
+            cmd (str): shell command
+
+        Returns:
+            tuple[int, bytes, bytes] | None: returncode, stdout and stderr
+            of the command, None if not cached
+        """
+        try:
+            with open(self.__key_path(cmd), 'rb') as f:
+                returncode, stdout, stderr = marshal.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, TypeError) as err:
+            log.debug('Invalid cache entry for [%s]. Ignored: %s', cmd, err)
+            return None
+        return returncode, stdout, stderr
+
+    def set(self, cmd: str, returncode: int, stdout: bytes, stderr: bytes) -> None:
+        """Store result of the command.
+
+        Args:
+            cmd (str): shell command
+            returncode (int): exit code of the command
+            stdout (bytes): captured stdout
+            stderr (bytes): captured stderr
+        """
+        # write to a temporary file first, so concurrent readers never see
+        # a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.__path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((returncode, stdout, stderr), f)
+            os.replace(tmp_path, self.__key_path(cmd))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
@@ -2,11 +2,11 @@ from __future__ import annotations
 
 import logging
 import os
-import importlib.util
+import builtins
 import enum
 
 from types import ModuleType
-from typing import List, Generator
+from typing import Generator
 from dataclasses import dataclass
 
 log = logging.getLogger( __name__)
@@ -17,13 +17,78 @@ class ResultExecStatus(enum.Enum):
     SKIPPED = 'SKIPPED'
     DRY_RUN = 'DRY_RUN'
 
-@dataclass
+@dataclass(slots=True)
 class ResultExec():
     module: CDMSModuleLoader
     n_cmd:  int
     status: ResultExecStatus
-    stdout: str = ''
-    stderr: str = ''
+    stdout: bytes = b''
+    stderr: bytes = b''
+    cached: bool = False
+
+def _literal_cmds(path: str) -> list[str] | None:
+    """Get CMDS from a py file without executing it.
+
+    Only accepted if executing the file can not fail or have side effects:
+    its top level holds nothing but a docstring, __future__ imports and
+    assignments of literals to names.
+
+    Args:
+        path (str): path to file
+
+    Returns:
+        list[str] | None: CMDS list, None if it can be found only by executing
+        the module
+    """
+    # imported here, only needed when loading a py file
+    import ast
+
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+    except (OSError, SyntaxError, ValueError):
+        # let the module import report the error
+        return None
+
+    values = {}
+    for n_node, node in enumerate(tree.body):
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant):
+            continue
+
+        if isinstance(node, ast.ImportFrom) and node.module == '__future__':
+            import __future__
+
+            # must be first, invalid features fail at compile time
+            if any(not isinstance(prev, ast.Expr) for prev in tree.body[:n_node]) \
+                    or any(alias.name not in __future__.all_feature_names for alias in node.names):
+                return None
+            continue
+
+        if isinstance(node, ast.Assign):
+            targets, value = node.targets, node.value
+        elif isinstance(node, ast.AnnAssign) and node.simple:
+            # the annotation is evaluated too, unless postponed
+            if not isinstance(node.annotation, ast.Constant) \
+                    and not (isinstance(node.annotation, ast.Name)
+                             and hasattr(builtins, node.annotation.id)):
+                return None
+            targets, value = [node.target], node.value
+        else:
+            return None
+
+        if not all(isinstance(target, ast.Name) for target in targets):
+            return None
+        if value is None:
+            continue
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            return None
+        for target in targets:
+            values[target.id] = value
+
+    cmds = values.get('CMDS')
+    return cmds if isinstance(cmds, list) else None
 
 class CDMSModuleLoader():
     def __init__(self, pyfile: str | None = None, path: str | None = None) -> None:
@@ -35,7 +100,9 @@ class CDMSModuleLoader():
             path (str | None, optional): path to file. Defaults to None.
         """
         self.__pymodule: ModuleType | None = None
-        self.__cmds: List[str] | None = None
+        self.__cmds: list[str] | None = None
+        self.__unique_cmds: dict[str, int] | None = None
+        self.__duplicates: dict[int, str] | None = None
 
         # Load module if pyfile and path are provided
         if pyfile is not None and path is not None:
@@ -87,6 +154,39 @@ class CDMSModuleLoader():
         else:
             raise ValueError('CMDS not loaded yet')
 
+    @property
+    def unique_cmds(self) -> Generator[tuple[int, str], None, None]:
+        """Return the CMDS list without duplicates as a generator.
+
+        Raises:
+            ValueError: raise if CMDS is not loaded yet.
+
+        Yields:
+            Generator[tuple[int, str], None, None]: index in CMDS and command,
+            for the first occurrence of each command
+        """
+        if self.__unique_cmds is not None:
+            for cmd, n_cmd in self.__unique_cmds.items():
+                yield n_cmd, cmd
+        else:
+            raise ValueError('CMDS not loaded yet')
+
+    @property
+    def duplicates(self) -> dict[int, str]:
+        """Getter for duplicated commands in CMDS.
+
+        Raises:
+            ValueError: raise if CMDS is not loaded yet.
+
+        Returns:
+            dict[int, str]: index in CMDS and command, for each repeated
+            occurrence of a command
+        """
+        if self.__duplicates is not None:
+            return self.__duplicates
+        else:
+            raise ValueError('CMDS not loaded yet')
+
     def load_pyfile(self, pyfile: str, path: str) -> None:
         """Load a py file as a module and get the CMDS list from it.
 
@@ -99,11 +199,19 @@ class CDMSModuleLoader():
             ImportError: raise if failed to load module
             ImportError: raise if failed to execute module
             ValueError: raise if CMDS with List type not found in module
+            ValueError: raise if CMDS contains non str items
         """
         if self.__pymodule is not None:
             raise ImportError('Module already loaded')
 
-        spec = importlib.util.spec_from_file_location(pyfile, os.path.join(path, pyfile))
+        import importlib.machinery
+        import importlib.util
+
+        # explicit SourceFileLoader, so compiled code is cached in and
+        # reused from __pycache__ while the source mtime is unchanged
+        spec = importlib.util.spec_from_file_location(
+            pyfile, os.path.join(path, pyfile),
+            loader=importlib.machinery.SourceFileLoader(pyfile, os.path.join(path, pyfile)))
         if spec is None or spec.loader is None:
             raise ImportError(f'Failed to load module from [{os.path.join(path, pyfile)}]')
 
@@ -111,14 +219,29 @@ class CDMSModuleLoader():
         if self.__pymodule is None:
             raise ImportError(f'Failed to load module from [{os.path.join(path, pyfile)}]')
 
-        try:
-            spec.loader.exec_module(self.__pymodule)
-        except Exception as err:
-            # if failed to execute module, reraise any as ImportErrors
-            raise ImportError(f'Failed to execute module [{os.path.join(path, pyfile)}]: {err}') from err
-        log.debug('Executed module [%s]', self.__pymodule.__name__)
-
-        self.__cmds = getattr(self.__pymodule, 'CMDS', None)
-        if self.__cmds is None or not isinstance(self.__cmds, List):
+        # a literal CMDS is read from the source, without executing the module
+        # and its side effects
+        self.__cmds = _literal_cmds(os.path.join(path, pyfile))
+        if self.__cmds is not None:
+            log.debug('Parsed module [%s]', self.__pymodule.__name__)
+        else:
+            try:
+                spec.loader.exec_module(self.__pymodule)
+            except Exception as err:
+                # if failed to execute module, reraise any as ImportErrors
+                raise ImportError(f'Failed to execute module [{os.path.join(path, pyfile)}]: {err}') from err
+            log.debug('Executed module [%s]', self.__pymodule.__name__)
+
+            self.__cmds = getattr(self.__pymodule, 'CMDS', None)
+        if self.__cmds is None or not isinstance(self.__cmds, list):
             raise ValueError(f'CMDS with List type not found in [{os.path.join(path, pyfile)}]')
+        if not all(isinstance(cmd, str) for cmd in self.__cmds):
+            raise ValueError(f'CMDS with non str items found in [{os.path.join(path, pyfile)}]')
         log.debug('Found CMDS [%s]', self.__cmds)
+
+        # dedup once at load time, keeping the first occurrence of each command
+        self.__unique_cmds = {}
+        self.__duplicates = {}
+        for n_cmd, cmd in enumerate(self.__cmds):
+            if self.__unique_cmds.setdefault(cmd, n_cmd) != n_cmd:
+                self.__duplicates[n_cmd] = cmd
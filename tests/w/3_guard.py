@@ -0,0 +1,2 @@
+CMDS=['echo 6', 'echo 7']
+raise ImportError('guard')